@@ -12,19 +12,25 @@ Listen and track nodes across locations when they broadcast the same hash.
 For the same location, if the port is the same, then the node must be the same.
 """
 
+import signal
 import socket
 import struct
 import threading
+import time
 import log
 
 STRUCT_FORMAT_STRING = "<B32s32s"
-STRUCT_SIZE = struct.calcsize(STRUCT_FORMAT_STRING)
+# Compiled once since every packet sent or received goes through it.
+PACKET = struct.Struct(STRUCT_FORMAT_STRING)
+STRUCT_SIZE = PACKET.size
 
 # Locations to sniff at.
 locations = [50050, 50100, 60060]
 
-# [(node_id, [(location, port)], {hashes}))]
-tracker: "list[tuple[str, set[tuple[str, int]], set[bytes]]]" = []
+# Node records are (node_id, {(location, port)}, {hashes}).
+# Indexed by every address and hash seen from them.
+addr_to_node: "dict[tuple[str, int], tuple[str, set[tuple[str, int]], set[bytes]]]" = {}
+hash_to_node: "dict[bytes, tuple[str, set[tuple[str, int]], set[bytes]]]" = {}
 node_id = 0
 
 def new_id():
@@ -33,27 +39,32 @@ def new_id():
     return f"Node {node_id}"
 
 def find_node(hash: "bytes", addr: "tuple[str, int]"):
-    for node in tracker:
-        if addr in node[1]:
-            # Found the port matching.
-            node[2].add(hash)
-            return node[0]
-        if hash in node[2]:
-            # Found the hash matching.
-            node[1].add(addr)
-            return node[0]
-    # not found
-    tracker.append((new_id(), {addr}, {hash}))
-    return tracker[-1][0]
+    # Matching port takes priority over matching hash.
+    node = addr_to_node.get(addr)
+    if node is None:
+        node = hash_to_node.get(hash)
+    if node is None:
+        # not found
+        node = (new_id(), set(), set())
+    node[1].add(addr)
+    node[2].add(hash)
+    addr_to_node[addr] = node
+    hash_to_node[hash] = node
+    return node[0]
 
 def thread(sock: socket.socket):
+    # Reused for every received packet.
+    buf = bytearray(STRUCT_SIZE)
     with sock:
         while True:
-            raw, addr = sock.recvfrom(STRUCT_SIZE)
-            idx, _, hash = struct.unpack(STRUCT_FORMAT_STRING, raw)
-            log.log("Received (", (str(idx), "MAGENTA"), ", ", (hash[:4].hex(), "BLUE"), ")", " from ", (str(addr), "CYAN"), sep="")
+            size, addr = sock.recvfrom_into(buf)
+            if size != STRUCT_SIZE:
+                # Not a share packet.
+                continue
+            idx, _, hash = PACKET.unpack_from(buf)
+            log.log("Received (", (str(idx), "MAGENTA"), ", ", (hash[:4].hex(), "BLUE"), ")", " from ", (str(addr), "CYAN"), sep="", level=log.DEBUG)
             id = find_node(hash, addr)
-            log.log("Associated", (hash[:4].hex(), "BLUE"), "with", (id, "RED"))
+            log.log("Associated", (hash[:4].hex(), "BLUE"), "with", (id, "RED"), level=log.DEBUG)
 
 def main():
     for location in locations:
@@ -63,8 +74,13 @@ def main():
         sock.bind(("", location))
         threading.Thread(target=thread, args=(sock,), daemon=True).start()
 
+    # Sleep until a signal (like KeyboardInterrupt) arrives.
     while True:
-        pass
+        if hasattr(signal, "pause"):
+            signal.pause()
+        else:
+            # Windows has no signal.pause().
+            time.sleep(3600)
 
 if __name__ == "__main__":
     try:
@@ -3,7 +3,8 @@ Main client program.
 Run `python3 Dimy.py -h` for a help menu on how to use.
 Only works on systems that have socket.SO_REUSEADDR defined (most systems).
 Some obscure systems may not work without SO_REUSEPORT set as well.
-This program has been tested on Python 3.7 - 3.9.
+Requires Python 3.11 or newer for the pinned packages in requirements.txt.
+This program has been tested on Python 3.11.
 """
 
 import argparse
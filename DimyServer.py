@@ -3,8 +3,8 @@ import threading
 import backend
 import log
 
-def main(port):
-    b = backend.Backend(port)
+def main(port, state):
+    b = backend.Backend(port, state)
     t = threading.Thread(target=b.start, daemon=True)
     t.start()
     try:
@@ -15,9 +15,12 @@ def main(port):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("port", type=int, help="Server port to use")
+    parser.add_argument("--state", type=str, default=backend.STATE_PATH,
+        help="File to keep the combined contact bloom filter in")
     args = parser.parse_args()
-    main(args.port)
+    main(args.port, args.state)
 
 """
 Server uses a second thread to allow for easy program quits.
+Uploaded CBFs are kept in the state file so they survive restarts. Delete it to start fresh.
 """
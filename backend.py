@@ -2,17 +2,51 @@
 The backend main program.
 """
 
+import mmap
+import os
 import socket
-from bloom import BloomFilter
+import threading
+from bloom import BloomFilter, FixedBloom100k3, contact_hits
 import log
 
+# File the combined CBFs are kept in between runs.
+STATE_PATH = "state.bf"
+# Trailer written after the filter bytes so filters with old bit positions are rejected.
+STATE_TRAILER = b"DIMYBF" + bytes([FixedBloom100k3.LAYOUT_VERSION])
+# Seconds a client connection may sit idle before it is dropped.
+# Longer than the 9 minute QBF interval; clients reconnect on their next upload.
+IDLE_TIMEOUT = 600
+
 class Backend(object):
-    def __init__(self, port: "int"):
+    def __init__(self, port: "int", state_path: "str" = STATE_PATH):
         """
         Create the backend server at the given ip and port.
-        Generate a bloom filter and socket.
+        Generate a bloom filter backed by a memory mapped file at state_path and socket.
+        The file is created if it doesn't exist and is rejected if it was written
+        by a version with a different bloom filter layout.
         """
-        self.bf = BloomFilter()
+        fd = os.open(state_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.ftruncate(fd, BloomFilter.FILTER_SIZE)
+                os.lseek(fd, BloomFilter.FILTER_SIZE, os.SEEK_SET)
+                os.write(fd, STATE_TRAILER)
+            else:
+                trailer = b""
+                if size == BloomFilter.FILTER_SIZE + len(STATE_TRAILER):
+                    os.lseek(fd, BloomFilter.FILTER_SIZE, os.SEEK_SET)
+                    trailer = os.read(fd, len(STATE_TRAILER))
+                if trailer != STATE_TRAILER:
+                    raise ValueError(f"State file {state_path} was written with a different "
+                                     "bloom filter layout. Delete it to start with an empty filter.")
+            self.mm = mmap.mmap(fd, BloomFilter.FILTER_SIZE)
+        finally:
+            # The mapping stays valid after the descriptor is closed.
+            os.close(fd)
+        self.bf = BloomFilter(filter=self.mm)
+        # Guards self.bf between client threads.
+        self.lock = threading.Lock()
         self.port = port
 
     def start(self):
@@ -21,37 +55,63 @@ class Backend(object):
         sock.listen(10)
         log.log("Server started on port", (str(self.port), "GREEN"))
         while True:
-            # Listen and receive a BF from a client.
+            # Clients keep their connection open so each one gets its own thread.
             conn, addr = sock.accept()
-            # See if a CBF or QBF is being sent.
-            type = conn.recv(3).decode()
-            # Receive the BF
-            filter = int.from_bytes(self.recv(conn, BloomFilter.FILTER_SIZE), "little")
-            client_bf = BloomFilter(filter=filter)
-
-            if (type == "CBF"):
-                # Add the CBF to the existing BF of contacts.
-                self.bf |= client_bf
-                conn.send(b"Server: Contact Bloom Filter received.")
-                log.log("Contact Bloom Filter received from", (str(addr), "BLUE"))
-            else:
-                log.log("Doing match analysis on Query Bloom Filter from", (str(addr), "BLUE"))
-                # Check
-                if (self.bf & client_bf).count() >= BloomFilter.HASH_ROUNDS:
-                    conn.send(b"Server: You have been in contact with a positive case.")
-                    log.log("Node at ", (str(addr), "BLUE"), " has been in contact with a ", ("positive", "RED"), " case.", sep="")
-                else:
-                    conn.send(b"Server: No contact with a positive case was detected.")
-                    log.log("Node at ", (str(addr), "BLUE"), " has ", ("no detection", "GREEN"), ".", sep="")
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Notice peers that vanished without closing the connection.
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            conn.settimeout(IDLE_TIMEOUT)
+            threading.Thread(target=self.handle, args=(conn, addr), daemon=True).start()
+
+    def handle(self, conn: "socket.socket", addr: "tuple[str, int]"):
+        """
+        Handle BFs from a client until it disconnects or is idle for IDLE_TIMEOUT seconds.
+        Each request is a 3 byte type followed by the BF. Each response is a newline terminated message.
+        """
+        with conn:
+            try:
+                while True:
+                    # See if a CBF or QBF is being sent.
+                    type = self.recv(conn, 3).decode()
+                    # Receive the BF
+                    client_bf = BloomFilter(filter=self.recv(conn, BloomFilter.FILTER_SIZE))
 
-            conn.close()
+                    if (type == "CBF"):
+                        # Add the CBF to the existing BF of contacts.
+                        with self.lock:
+                            self.bf |= client_bf
+                            self.mm.flush()
+                        conn.sendall(b"Server: Contact Bloom Filter received.\n")
+                        log.log("Contact Bloom Filter received from", (str(addr), "BLUE"))
+                    else:
+                        log.log("Doing match analysis on Query Bloom Filter from", (str(addr), "BLUE"))
+                        # Check
+                        with self.lock:
+                            matched = contact_hits(self.bf.filter, client_bf.filter, BloomFilter.HASH_ROUNDS)
+                        if matched:
+                            conn.sendall(b"Server: You have been in contact with a positive case.\n")
+                            log.log("Node at ", (str(addr), "BLUE"), " has been in contact with a ", ("positive", "RED"), " case.", sep="")
+                        else:
+                            conn.sendall(b"Server: No contact with a positive case was detected.\n")
+                            log.log("Node at ", (str(addr), "BLUE"), " has ", ("no detection", "GREEN"), ".", sep="")
+            except socket.timeout:
+                log.log("Connection timed out from", (str(addr), "BLUE"))
+            except OSError:
+                log.log("Connection closed by", (str(addr), "BLUE"))
 
     def recv(self, sock: "socket.socket", length: "int"):
-        """Get a specific length from the connection"""
-        data = [b""]
+        """Get a specific length from the connection into a single preallocated buffer"""
+        buf = bytearray(length)
+        view = memoryview(buf)
         so_far = 0
         while so_far < length:
-            data.append(sock.recv(length - so_far))
-            so_far += len(data[-1])
-        return b"".join(data)
+            n = sock.recv_into(view[so_far:])
+            if not n:
+                raise ConnectionError("Connection closed before all data was received.")
+            so_far += n
+        return buf
 
@@ -1,40 +1,68 @@
 # Bloom filter implementation
 
 import hashlib
-import math
+import mmap
+import numpy as np
+
+def words(buf: "bytes | bytearray | mmap.mmap") -> "np.ndarray":
+    """
+    View a filter buffer as an array without copying. Uses 64 bit words when the
+    size allows it. Writable buffers give writable arrays.
+    """
+    return np.frombuffer(buf, np.uint64 if len(buf) % 8 == 0 else np.uint8)
 
 class BloomFilter(object):
+    """
+    Bloom filter over a fixed size bit array.
+
+    Indices are derived with the Kirsch-Mitzenmacher construction: a single 128 bit
+    blake2b digest is split into two 64 bit halves h1 and h2 and round i uses
+    (h1 + i * h2) % bit_size.
+    Filters with the default parameters are created as FixedBloom100k3 instead.
+    """
     FILTER_SIZE = 100000
     HASH_ROUNDS = 3
 
-    def __init__(self, byte_size = FILTER_SIZE, hash_rounds = HASH_ROUNDS, filter = 0):
+    def __new__(cls, byte_size = FILTER_SIZE, hash_rounds = HASH_ROUNDS, filter = None):
+        if cls is BloomFilter and byte_size == cls.FILTER_SIZE and hash_rounds == cls.HASH_ROUNDS:
+            cls = FixedBloom100k3
+        return super().__new__(cls)
+
+    def __init__(self, byte_size = FILTER_SIZE, hash_rounds = HASH_ROUNDS, filter = None):
         """
         Create a bloom filter with the given size (in bytes), hash rounds and optional initial filter.
         
         Default is 100 KB (800000 bits), 3 hash rounds and a filter starting at 0.
+        The filter is a bytearray where bit i is stored in byte i // 8 (little endian).
+        An initial bytearray or mmap is used as is without copying.
         """
-        if filter.bit_length() > byte_size * 8:
-            raise ValueError("Initial filter must be at most byte_size.")
+        if filter is None:
+            filter = bytearray(byte_size)
+        elif not isinstance(filter, (bytearray, mmap.mmap)):
+            filter = bytearray(filter)
+        if len(filter) != byte_size:
+            raise ValueError("Initial filter must be exactly byte_size.")
         self.byte_size = byte_size
         self.bit_size = byte_size * 8
-        self.digest_size = math.ceil(self.bit_size.bit_length() / 8)
         self.hash_rounds = hash_rounds
         self.filter = filter
 
-    def generate_hashes(self, key: "int"):
-        """Generate the hashes for the key."""
-        key = str(key).encode()
+    def generate_hashes(self, key: "int | bytes"):
+        """Generate the hashes for the key. Keys that are already bytes are not re-encoded."""
+        if not isinstance(key, bytes):
+            key = str(key).encode()
 
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little")
         for i in range(self.hash_rounds):
-            digest = hashlib.blake2b(key, digest_size=self.digest_size,
-                key=str(i).encode()).digest()
-            idx = int.from_bytes(digest, "little") % self.bit_size
-            yield idx
+            yield (h1 + i * h2) % self.bit_size
 
     def add(self, key: "int"):
         """Add a key into the bloom filter."""
+        filter = self.filter
         for index in self.generate_hashes(key):
-            self.filter |= 1 << index
+            filter[index >> 3] |= 1 << (index & 7)
 
     def query(self, key: "int"):
         """Whether this bloom filter contains the given key."""
@@ -42,22 +70,37 @@ class BloomFilter(object):
     
     def __contains__(self, key: "int"):
         """Whether this bloom filter contains the given key."""
-        checker = 0
+        filter = self.filter
         for index in self.generate_hashes(key):
-            checker |= 1 << index
-        return (checker & self.filter) == checker
+            if not filter[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
 
     def __or__(self, other: "BloomFilter"):
         if not self.same_param(other):
             raise NotImplementedError("Filters must have the same starting parameters.")
-        new_filter = self.filter | other.filter
-        return BloomFilter(self.byte_size, self.hash_rounds, new_filter)
+        new = BloomFilter(self.byte_size, self.hash_rounds)
+        np.bitwise_or(words(self.filter), words(other.filter), out=words(new.filter))
+        return new
+
+    def __ior__(self, other: "BloomFilter"):
+        if not self.same_param(other):
+            raise NotImplementedError("Filters must have the same starting parameters.")
+        # Merge in place so the existing buffer is reused.
+        dst = words(self.filter)
+        np.bitwise_or(dst, words(other.filter), out=dst)
+        return self
     
     def __and__(self, other: "BloomFilter"):
         if not self.same_param(other):
             raise NotImplementedError("Filters must have the same starting parameters.")
-        new_filter = self.filter & other.filter
-        return BloomFilter(self.byte_size, self.hash_rounds, new_filter)
+        new = BloomFilter(self.byte_size, self.hash_rounds)
+        np.bitwise_and(words(self.filter), words(other.filter), out=words(new.filter))
+        return new
+
+    def is_empty(self) -> "bool":
+        """Whether no bits are set in this filter."""
+        return not words(self.filter).any()
 
     def same_param(self, other: "BloomFilter"):
         """Check that this bloom filter and the other were made with the same starting parameters."""
@@ -69,10 +112,71 @@ class BloomFilter(object):
         return flag
     
     def count(self):
-        """Count number of set bits in this filter. Only efficient for sparse filters."""
-        c = 0
+        """Count number of set bits in this filter."""
+        return int(np.bitwise_count(words(self.filter)).sum())
+
+class FixedBloom100k3(BloomFilter):
+    """
+    BloomFilter specialised for the default FILTER_SIZE and HASH_ROUNDS.
+
+    A single 24 byte blake2b digest gives three 64 bit values h and each is mapped
+    to an index with Lemire's fast range reduction (h * bit_size) >> 64, which
+    avoids a modulo since 800000 bits is not a power of two.
+    """
+    BIT_SIZE = BloomFilter.FILTER_SIZE * 8
+    # Bump whenever the mapping from items to bit positions changes.
+    LAYOUT_VERSION = 1
+    MASK_64 = (1 << 64) - 1
+
+    def __init__(self, byte_size = BloomFilter.FILTER_SIZE, hash_rounds = BloomFilter.HASH_ROUNDS, filter = None):
+        """Create a bloom filter. Only the default size and hash rounds are supported."""
+        if byte_size != self.FILTER_SIZE or hash_rounds != self.HASH_ROUNDS:
+            raise ValueError(f"{type(self).__name__} only supports byte_size={self.FILTER_SIZE} "
+                f"and hash_rounds={self.HASH_ROUNDS}. Use BloomFilter instead.")
+        super().__init__(byte_size, hash_rounds, filter)
+
+    def generate_hashes(self, key: "int | bytes"):
+        """Generate the hashes for the key. Keys that are already bytes are not re-encoded."""
+        if not isinstance(key, bytes):
+            key = str(key).encode()
+
+        h = int.from_bytes(hashlib.blake2b(key, digest_size=24).digest(), "little")
+        mask = self.MASK_64
+        bit_size = self.BIT_SIZE
+        return (((h & mask) * bit_size) >> 64,
+                (((h >> 64) & mask) * bit_size) >> 64,
+                ((h >> 128) * bit_size) >> 64)
+
+    def add(self, key: "int | bytes"):
+        """Add a key into the bloom filter."""
+        a, b, c = self.generate_hashes(key)
         filter = self.filter
-        while filter:
-            c += 1
-            filter &= filter - 1
-        return c
+        filter[a >> 3] |= 1 << (a & 7)
+        filter[b >> 3] |= 1 << (b & 7)
+        filter[c >> 3] |= 1 << (c & 7)
+
+    def __contains__(self, key: "int | bytes"):
+        """Whether this bloom filter contains the given key."""
+        a, b, c = self.generate_hashes(key)
+        filter = self.filter
+        return bool(filter[a >> 3] & (1 << (a & 7))
+            and filter[b >> 3] & (1 << (b & 7))
+            and filter[c >> 3] & (1 << (c & 7)))
+
+# Bytes compared at a time by contact_hits.
+CONTACT_BLOCK_SIZE = 4096
+
+def contact_hits(a: "bytes", b: "bytes", target: "int") -> "bool":
+    """
+    Whether the filters a and b share at least target set bits.
+    Works block by block so no intermediate filter is built and returns as soon as target is reached.
+    """
+    a, b = words(a), words(b)
+    # Block size in elements rather than bytes.
+    step = CONTACT_BLOCK_SIZE // a.itemsize
+    hits = 0
+    for i in range(0, min(len(a), len(b)), step):
+        hits += int(np.bitwise_count(a[i:i+step] & b[i:i+step]).sum())
+        if hits >= target:
+            return True
+    return False
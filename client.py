@@ -2,10 +2,11 @@
 Main client object
 """
 
-from collections import deque, defaultdict
+from collections import deque, OrderedDict
 import queue
 import itertools
 import random
+import selectors
 import socket
 import struct
 from sched import scheduler
@@ -51,7 +52,9 @@ secure and can produce a customised digest size.
 """
 # Python Struct format string:
 STRUCT_FORMAT_STRING = "<B32s32s"
-STRUCT_SIZE = struct.calcsize(STRUCT_FORMAT_STRING)
+# Compiled once since every packet sent or received goes through it.
+PACKET = struct.Struct(STRUCT_FORMAT_STRING)
+STRUCT_SIZE = PACKET.size
 
 # Scheduler for all client functions. Do SCHED.run() to start everything.
 SCHED = scheduler(time.time, time.sleep)
@@ -72,16 +75,19 @@ class Client(object):
         self.sock_send.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
         # Secret associated with the most recent share broadcast.
-        self.last_secret = 0
+        self.last_secret = bytes(32)
 
         # Current location (port) of the client.
         self.location = 0
 
-        # The listener socket for shares.
+        # The listener socket for shares. Registered with the selector once bound by a MOVE.
         self.sock_recv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.selector = selectors.DefaultSelector()
+        # Reused for every received share.
+        self.recv_buf = bytearray(STRUCT_SIZE)
 
-        # {hash: (time, [shares], secret)}
-        self.shares = defaultdict(lambda:(time.rel(), []))
+        # {hash: (time, [shares])} in order of first arrival.
+        self.shares: "OrderedDict[bytes, tuple[float, list[sss.Share]]]" = OrderedDict()
         self.own_shares = set()
 
         # Accurate command file timer.
@@ -95,8 +101,18 @@ class Client(object):
         self.eph_gen()
         SCHED.enter(time.till_next(SHARE_TIME), 1, self.eph_share)
         SCHED.enter(time.till_next(EPHID_TIME), 1, self.share_clean)
-        SCHED.enter(0.1, 1, self.listen)
-        SCHED.run()
+        self.run()
+
+    def run(self):
+        """
+        Main event loop. Runs due scheduler events then waits on the share socket
+        until either a share arrives or the next event is due.
+        """
+        while True:
+            delay = SCHED.run(blocking=False)
+            timeout = None if delay is None else time.real(delay)
+            if self.selector.select(timeout):
+                self.listen()
 
     def eph_gen(self):
         """Generate a new EphID and create shares from it."""
@@ -128,35 +144,49 @@ class Client(object):
         log.log("Broadcast to ", (f"{self.location}", "GREEN"), ": (", (str(idx), "MAGENTA"), ", ", (hash, "BLUE"), ")", sep="")
 
         self.last_secret = share[1]
-        packet = struct.pack(STRUCT_FORMAT_STRING, share[0][0], share[0][1], share[2])
+        packet = PACKET.pack(share[0][0], share[0][1], share[2])
         self.sock_send.sendto(packet, ("<broadcast>", self.location))
 
     def share_clean(self):
         """Clean up old shares from the share dict"""
         # Reschedule this function.
         SCHED.enter(time.till_next(EPHID_TIME), 1, self.share_clean)
-        for k, v in self.shares.copy().items():
-            if time.rel() - v[0] > SHARE_CLEAN_TIME:
-                log.log("Discarded:", (k[:4].hex(), "BLUE"))
-                del self.shares[k]
+        # Oldest entries are at the front so stop at the first one that hasn't expired.
+        while self.shares:
+            k, v = next(iter(self.shares.items()))
+            if time.rel() - v[0] <= SHARE_CLEAN_TIME:
+                break
+            log.log("Discarded:", (k[:4].hex(), "BLUE"))
+            self.shares.popitem(last=False)
 
     def listen(self):
-        """Listen for a broadcast and process it if possible"""
-        # Try every 0.1s. Maximum throughput: 10 shares/s.
-        SCHED.enter(0.1, 1, self.listen)
-        try:
-            raw, _ = self.sock_recv.recvfrom(STRUCT_SIZE)
-        except (socket.timeout, BlockingIOError):
-            # No share available.
-            return
-        idx, share, hash = struct.unpack(STRUCT_FORMAT_STRING, raw)
+        """Process every broadcast waiting on the share socket"""
+        while True:
+            try:
+                size, _ = self.sock_recv.recvfrom_into(self.recv_buf)
+            except (socket.timeout, BlockingIOError):
+                # No more shares available.
+                return
+            if size != STRUCT_SIZE:
+                # Not a share packet.
+                continue
+            self.process_share(self.recv_buf)
+
+    def process_share(self, raw: "bytes | bytearray"):
+        """Process a received share and reconstruct the EphID if possible"""
+        idx, share, hash = PACKET.unpack_from(raw)
 
         # Filter out own shares.
         if hash in self.own_shares: return
 
-        self.shares[hash][1].append((idx, share))
+        if hash not in self.shares:
+            self.shares[hash] = (time.rel(), [])
+        shares = self.shares[hash][1]
+        # Ignore repeated broadcasts of a share that was already received.
+        if any(idx == i for i, _ in shares): return
+        shares.append((idx, share))
 
-        log.log("Received: (", (str(idx), "MAGENTA"), ", ", (hash[:4].hex(), "BLUE"), ")", sep="")
+        log.log("Received: (", (str(idx), "MAGENTA"), ", ", (hash[:4].hex(), "BLUE"), ")", sep="", level=log.DEBUG)
 
         if len(self.shares[hash][1]) >= SHARE_K:
             # Can reconstruct.
@@ -209,12 +239,15 @@ class Client(object):
         self.location = location
 
         # Make a new socket using this location.
+        if self.sock_recv in self.selector.get_map():
+            self.selector.unregister(self.sock_recv)
         self.sock_recv.close()
         self.sock_recv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock_recv.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.sock_recv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock_recv.setblocking(False)
         self.sock_recv.bind(("", self.location))
+        self.selector.register(self.sock_recv, selectors.EVENT_READ)
 
     def cmd_positive(self, period: "int"):
         """Handle the POSITIVE command."""
@@ -239,9 +272,14 @@ class DBFContainer(object):
     """
     def __init__(self, ip: "str", port: "int"):
         self.serv_addr = (ip, port)
+        # Connection to the backend, reused between uploads.
+        self.sock: "socket.socket | None" = None
         # + 1 because the order of making a QBF or cycling DBF is undefined.
         dbf_count = DBF_LIFE // DBF_TIME + 1
         self.dbfs: "deque[BloomFilter]" = deque([BloomFilter()], dbf_count)
+        # Running union of all DBFs. Only rebuilt when a non empty DBF is removed.
+        self.combined = BloomFilter()
+        self.combined_dirty = False
 
         # Flag to swap between making QBFs and CBFs
         self.is_cbf = False
@@ -266,32 +304,67 @@ class DBFContainer(object):
             self.contact_backend("CBF", combined)
 
     def combine(self):
-        """Combine all available DBFs"""
-        cbf = BloomFilter()
-        for dbf in self.dbfs:
-            cbf |= dbf
-        return cbf
+        """Combine all available DBFs. The returned filter is shared so don't modify it."""
+        if self.combined_dirty:
+            self.combined = BloomFilter()
+            for dbf in self.dbfs:
+                self.combined |= dbf
+            self.combined_dirty = False
+        return self.combined
 
     def dbf_cycle(self):
         """Cycle DBFs"""
         # Reschedule this function.
         SCHED.enter(time.till_next(DBF_TIME), 2, self.dbf_cycle)
         # Create a new DBF. Also removes the oldest one if there are too many.
+        if len(self.dbfs) == self.dbfs.maxlen and not self.dbfs[0].is_empty():
+            # Its bits may still be in the running union.
+            self.combined_dirty = True
         self.dbfs.append(BloomFilter())
         log.log("Created new DBF")
 
     def add(self, EncID: "int"):
         """Adds EncID to the current DBF"""
         self.dbfs[-1].add(EncID)
+        self.combined.add(EncID)
 
     def contact_backend(self, type: "str", bf: "BloomFilter"):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect(self.serv_addr)
-        sock.send(type.encode())
-        sock.sendall(bf.filter.to_bytes(BloomFilter.FILTER_SIZE, "little"))
-        resp = sock.recv(1024).decode()
+        try:
+            resp = self.send_filter(type, bf)
+        except OSError:
+            # The server may have dropped the connection since the last upload.
+            # Retry once on a fresh connection.
+            self.disconnect()
+            resp = self.send_filter(type, bf)
         log.log((resp, "YELLOW", "UNDERLINE"))
-        sock.close()
+
+    def send_filter(self, type: "str", bf: "BloomFilter") -> "str":
+        """Send a BF of the given type to the backend and return its response."""
+        sock = self.connect()
+        sock.sendall(type.encode())
+        sock.sendall(bf.filter)
+        resp = b""
+        while not resp.endswith(b"\n"):
+            data = sock.recv(1024)
+            if not data:
+                raise ConnectionError("Server closed the connection.")
+            resp += data
+        return resp[:-1].decode()
+
+    def connect(self) -> "socket.socket":
+        """Get the connection to the backend, connecting first if there isn't one."""
+        if self.sock is None:
+            sock = socket.create_connection(self.serv_addr)
+            # Don't hold back the end of a BF waiting for more data.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock = sock
+        return self.sock
+
+    def disconnect(self):
+        """Close the connection to the backend if there is one."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
 
 class ProgramStop(Exception):
     """Exception for program stop."""
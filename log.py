@@ -1,7 +1,13 @@
 """Simple logging functionality for Dimy"""
 
+import sys
 import timekeeper as time
 
+# Log levels. Messages below LOG_LEVEL are skipped before any formatting is done.
+DEBUG = 10
+INFO = 20
+LOG_LEVEL = DEBUG
+
 """
 Color codes taken from Blender build scripts.
 https://svn.blender.org/svnroot/bf-blender/trunk/blender/build_files/scons/tools/bcolors.py
@@ -25,19 +31,31 @@ colors = {"MAGENTA": MAGENTA,
           "UNDERLINE": UNDERLINE,
           "RESET": RESET}
 
-def log(*values: "str | tuple[str, ...]", sep=" "):
+# Joined color codes for each combination of colors used so far.
+# {(col, ...): codes}
+color_cache: "dict[tuple[str, ...], str]" = {}
+
+def log(*values: "str | tuple[str, ...]", sep=" ", level=INFO):
     """
     Works similarly to the print statement.
     Arguments can be a tuple in which case it is colored.
+    Per packet messages should use level=DEBUG so they can be turned off with LOG_LEVEL.
     """
+    if level < LOG_LEVEL:
+        return
     header = f"[{CYAN}{time.rel():07.2f}{RESET}] "
     joined = []
     for v in values:
         if isinstance(v, tuple):
             # text, *col
-            color = "".join(colors[x] for x in v[1:])
+            cols = v[1:]
+            color = color_cache.get(cols)
+            if color is None:
+                color = color_cache[cols] = "".join(colors[x] for x in cols)
             joined.append(color + v[0] + RESET)
         elif isinstance(v, str):
             # raw text
             joined.append(v)
-    print(header + sep.join(joined))
+    # One write per line so lines from different threads don't interleave.
+    # stdout is line buffered on a terminal and block buffered when redirected.
+    sys.stdout.write(header + sep.join(joined) + "\n")
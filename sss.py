@@ -1,29 +1,109 @@
 """
-Shamir Secret Sharing. Wrapper around pycryptodome that supports more than 16 byte secrets.
-Uses code from a current open pull request for such a feature in the main library.
-https://github.com/Legrandin/pycryptodome/pull/593
-Discussions about the security of the implementation are available on the pull request page
-or on stackoverflow (https://crypto.stackexchange.com/questions/98243/is-it-secure-to-do-shamir-key-split-on-a-key-in-blocks-and-recombine)
-which conclude that this implementation is as secure as the pycryptodome implementation.
+Shamir Secret Sharing over GF(2^128) for secrets longer than 16 bytes.
+
+The secret is split into 16 byte blocks and each block is shared independently with the
+same share indices, following the block approach from a pycryptodome pull request
+(https://github.com/Legrandin/pycryptodome/pull/593, discussed at
+https://crypto.stackexchange.com/questions/98243/is-it-secure-to-do-shamir-key-split-on-a-key-in-blocks-and-recombine).
+The field arithmetic is implemented here rather than calling pycryptodome's Shamir per
+block. It uses the same element encoding and reduction polynomial, so shares are
+interchangeable with Shamir.split() / Shamir.combine() for each block (see test_sss.py).
+
+This is not the code reviewed in those discussions. combine() multiplies through tables
+indexed by share bytes, so it is not constant time. Shares here protect short lived
+public keys which are broadcast anyway, not long term secrets.
 """
 
 import itertools
-from Crypto.Protocol.SecretSharing import Shamir
-from Crypto.PublicKey import ECC
+from Crypto.Random import get_random_bytes
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
+from functools import lru_cache
 from hashlib import blake2b
 from hmac import compare_digest
 from typing import Tuple
 import Ed25519
 
 Share = Tuple[int, bytes]
-Packet = Tuple[Share, int, bytes]
+Packet = Tuple[Share, bytes, bytes]
 
 SHAMIR_BLOCK_SIZE = 16
 
+"""
+GF(2^128) arithmetic with the same representation as pycryptodome's Shamir:
+elements are 128 bit integers (big endian when encoded) where bit i is the
+coefficient of x^i, reduced by x^128 + x^7 + x^2 + x + 1. Shares made here
+can be combined by Shamir.combine() and vice versa.
+"""
+GF_MASK = (1 << 128) - 1
+GF_IRR_POLY = (1 << 128) | 0x87
+
+def _gf_reduce(x: "int") -> "int":
+    """Reduce a carryless product of two field elements (at most 255 bits)."""
+    # Fold twice since the first fold can overflow by up to 7 bits.
+    for _ in range(2):
+        hi = x >> 128
+        x = (x & GF_MASK) ^ hi ^ (hi << 1) ^ (hi << 2) ^ (hi << 7)
+    return x
+
+def _gf_mul(a: "int", b: "int") -> "int":
+    """Multiply two field elements. Fast when b is small (like a share index)."""
+    z = 0
+    while b:
+        if b & 1:
+            z ^= a
+        a <<= 1
+        b >>= 1
+    return _gf_reduce(z)
+
+def _gf_power(x: "int", exponent: "int") -> "int":
+    """x ** exponent for a small field element x."""
+    result = 1
+    for _ in range(exponent):
+        result = _gf_mul(result, x)
+    return result
+
+def _gf_inverse(a: "int") -> "int":
+    """Inverse of a non zero field element using the extended Euclidean algorithm."""
+    u, v = a, GF_IRR_POLY
+    g1, g2 = 1, 0
+    while u != 1:
+        j = u.bit_length() - v.bit_length()
+        if j < 0:
+            u, v = v, u
+            g1, g2 = g2, g1
+            j = -j
+        u ^= v << j
+        g1 ^= g2 << j
+    return g1
+
+@lru_cache(maxsize=64)
+def _lagrange_tables(indices: "tuple[int, ...]") -> "list[list[int]]":
+    """
+    Lagrange coefficients at 0 for the given share indices, each expanded into a
+    table of its unreduced carryless product with every byte value.
+    Only depends on the indices so is cached across reconstructions.
+    """
+    tables = []
+    for j, x_j in enumerate(indices):
+        numerator = denominator = 1
+        for m, x_m in enumerate(indices):
+            if m != j:
+                numerator = _gf_mul(numerator, x_m)
+                denominator = _gf_mul(denominator, x_j ^ x_m)
+        coeff = _gf_mul(_gf_inverse(denominator), numerator)
+        table = [0] * 256
+        for bit in range(8):
+            step = coeff << bit
+            for byte in range(1 << bit, 1 << (bit + 1)):
+                table[byte] = table[byte ^ (1 << bit)] ^ step
+        tables.append(table)
+    return tables
+
 def split(k: "int", n: "int", secret: "bytes", ssss=False) -> "list[Share]":
     """
-    Wrapper for Shamir.split()
-    when len(key) > SHAMIR_BLOCK_SIZE (16)
+    Equivalent to Shamir.split() applied to every SHAMIR_BLOCK_SIZE (16) byte block
+    of the secret, for when len(key) > SHAMIR_BLOCK_SIZE.
     """
     if not isinstance(secret, bytes):
         raise TypeError("Secret must be bytes")
@@ -31,18 +111,25 @@ def split(k: "int", n: "int", secret: "bytes", ssss=False) -> "list[Share]":
         raise ValueError(f"Secret size must be a multiple of {SHAMIR_BLOCK_SIZE}")
 
     blocks = len(secret) // SHAMIR_BLOCK_SIZE
-    shares = [b'' for _ in range(n)]
+    shares = [[] for _ in range(n)]
     for i in range(blocks):
-        block_shares = Shamir.split(k, n,
-                secret[i*SHAMIR_BLOCK_SIZE:(i+1)*SHAMIR_BLOCK_SIZE], ssss)
+        # Random coefficients with the secret block as the constant term.
+        coeffs = [int.from_bytes(get_random_bytes(SHAMIR_BLOCK_SIZE), "big") for _ in range(k - 1)]
+        coeffs.append(int.from_bytes(secret[i*SHAMIR_BLOCK_SIZE:(i+1)*SHAMIR_BLOCK_SIZE], "big"))
         for j in range(n):
-            shares[j] += block_shares[j][1]
-    return [(i+1,shares[i]) for i in range(n)]
+            idx = j + 1
+            share = 0
+            for coeff in coeffs:
+                share = _gf_mul(share, idx) ^ coeff
+            if ssss:
+                share ^= _gf_mul(_gf_power(idx, len(coeffs) - 1), idx)
+            shares[j].append(share.to_bytes(SHAMIR_BLOCK_SIZE, "big"))
+    return [(i+1, b"".join(shares[i])) for i in range(n)]
 
 def combine(shares: "list[Share]", ssss=False):
     """
-    Wrapper for Shamir.combine()
-    when len(key) > SHAMIR_BLOCK_SIZE (16)
+    Equivalent to Shamir.combine() applied to every SHAMIR_BLOCK_SIZE (16) byte block
+    of the shares, for when len(key) > SHAMIR_BLOCK_SIZE.
     """
     share_len = len(shares[0][1])
     for share in shares:
@@ -50,22 +137,35 @@ def combine(shares: "list[Share]", ssss=False):
             raise ValueError(f"Share #{share[0]} is not a multiple of {SHAMIR_BLOCK_SIZE}")
         if len(share[1]) != share_len:
             raise ValueError("Share sizes are inconsistent")
+    indices = tuple(int(idx) for idx, _ in shares)
+    if len(set(indices)) != len(indices):
+        raise ValueError("Duplicate share")
+    tables = _lagrange_tables(indices)
     blocks = share_len // SHAMIR_BLOCK_SIZE
-    result = b''
+    result = []
     for i in range(blocks):
-        block_shares = [
-                (int(idx), share[i*SHAMIR_BLOCK_SIZE:(i+1)*SHAMIR_BLOCK_SIZE]) 
-            for idx, share in shares]
-        result += Shamir.combine(block_shares, ssss)
-    return result
+        # Sum of share * coefficient, reduced once at the end since reduction is linear.
+        acc = 0
+        for (idx, share), table in zip(shares, tables):
+            block = share[i*SHAMIR_BLOCK_SIZE:(i+1)*SHAMIR_BLOCK_SIZE]
+            if ssss:
+                block = (int.from_bytes(block, "big")
+                    ^ _gf_power(int(idx), len(shares))).to_bytes(SHAMIR_BLOCK_SIZE, "big")
+            product = 0
+            for byte in block:
+                product = (product << 8) ^ table[byte]
+            acc ^= product
+        result.append(_gf_reduce(acc).to_bytes(SHAMIR_BLOCK_SIZE, "big"))
+    return b"".join(result)
 
 def generate(k: "int", n: "int") -> "list[Packet]":
     """Returns [(shares, secret, hash)]"""
-    key = ECC.generate(curve="Ed25519")
-    public = Ed25519.compress_key(key.pointQ)
+    key = X25519PrivateKey.generate()
+    public = Ed25519.compress_key(key.public_key())
+    secret = key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
     h = blake2b(public, digest_size=32).digest()
 
-    return list(zip(split(k, n, public), itertools.repeat(key.d), itertools.repeat(h)))
+    return list(zip(split(k, n, public), itertools.repeat(secret), itertools.repeat(h)))
 
 def verify(shares: "list[Share]", hash: "bytes"):
     """
@@ -78,6 +178,7 @@ def verify(shares: "list[Share]", hash: "bytes"):
         return shared
     return False
 
-def calc_shared(public: "bytes", secret: "int") -> "int":
-    # Calculate the shared as the x component of the point.
-    return int((Ed25519.decompress_key(public) * secret).x)
+def calc_shared(public: "bytes", secret: "bytes") -> "int":
+    # Calculate the shared as the u coordinate of the X25519 exchange.
+    shared = X25519PrivateKey.from_private_bytes(secret).exchange(Ed25519.decompress_key(public))
+    return int.from_bytes(shared, "little")
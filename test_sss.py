@@ -0,0 +1,49 @@
+"""Checks that sss shares are interchangeable with pycryptodome's Shamir."""
+
+import itertools
+import os
+import unittest
+from Crypto.Protocol.SecretSharing import Shamir
+import sss
+
+class ShamirInteropTest(unittest.TestCase):
+    K = 3
+    N = 5
+
+    def test_round_trip(self):
+        secret = os.urandom(32)
+        shares = sss.split(self.K, self.N, secret)
+        for subset in itertools.permutations(shares, self.K):
+            self.assertEqual(sss.combine(list(subset)), secret)
+
+    def test_sss_split_shamir_combine(self):
+        secret = os.urandom(32)
+        shares = sss.split(self.K, self.N, secret)
+        for subset in itertools.combinations(shares, self.K):
+            for i in range(0, len(secret), sss.SHAMIR_BLOCK_SIZE):
+                block = [(idx, share[i:i+sss.SHAMIR_BLOCK_SIZE]) for idx, share in subset]
+                self.assertEqual(Shamir.combine(block), secret[i:i+sss.SHAMIR_BLOCK_SIZE])
+
+    def test_shamir_split_sss_combine(self):
+        secret = os.urandom(32)
+        blocks = [Shamir.split(self.K, self.N, secret[i:i+sss.SHAMIR_BLOCK_SIZE])
+            for i in range(0, len(secret), sss.SHAMIR_BLOCK_SIZE)]
+        shares = [(idx, b"".join(block[j][1] for block in blocks))
+            for j, idx in enumerate(range(1, self.N + 1))]
+        for subset in itertools.combinations(shares, self.K):
+            self.assertEqual(sss.combine(list(subset)), secret)
+
+    def test_ssss_interop(self):
+        secret = os.urandom(16)
+        shares = sss.split(self.K, self.N, secret, ssss=True)
+        self.assertEqual(Shamir.combine(shares[:self.K], ssss=True), secret)
+        shares = Shamir.split(self.K, self.N, secret, ssss=True)
+        self.assertEqual(sss.combine(shares[1:self.K+1], ssss=True), secret)
+
+    def test_duplicate_share(self):
+        shares = sss.split(self.K, self.N, os.urandom(32))
+        with self.assertRaises(ValueError):
+            sss.combine([shares[0], shares[0], shares[1]])
+
+if __name__ == "__main__":
+    unittest.main()
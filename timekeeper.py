@@ -19,7 +19,11 @@ def time() -> float:
 
 def sleep(secs: float):
     """Delay execution for the number of seconds."""
-    time_real.sleep(secs / TIME_SCALE)
+    time_real.sleep(real(secs))
+
+def real(secs: float) -> float:
+    """Convert a duration in program time into real seconds."""
+    return secs / TIME_SCALE
 
 def till_next(interval: float) -> "float":
     """Calculate the delta till the next multiple of interval."""